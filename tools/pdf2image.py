@@ -2,10 +2,14 @@ import logging
 from collections.abc import Generator
 from typing import Any
 import io
-import base64
 from pathlib import Path
 import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
@@ -14,14 +18,42 @@ from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
+# Shared pool for page encoding; PIL and libjpeg-turbo release the GIL while encoding.
+# Kept small on purpose: every in-flight page holds a full raw pixmap (~100 MB at 600 DPI),
+# and os.cpu_count() ignores container CPU quotas.
+_ENCODE_WORKERS = min(4, os.cpu_count() or 1)
+_ENCODE_POOL = ThreadPoolExecutor(max_workers=_ENCODE_WORKERS, thread_name_prefix="pdf2image-encode")
+
+# Pool for fetching remote files ahead of rendering; each invocation only keeps
+# the current file plus _PREFETCH_FILES more in memory
+_DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pdf2image-download")
+_PREFETCH_FILES = 1
+
+# requests.Session is not documented as thread-safe, so each download thread gets its own
+_http_local = threading.local()
+
+
+def _get_http_session() -> requests.Session:
+    """
+    Get the calling thread's HTTP session, reusing its pooled connections across downloads
+    """
+    session = getattr(_http_local, "session", None)
+    if session is None:
+        session = _http_local.session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+        session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+    return session
+
 
 class ToolParameters(BaseModel):
     files: list[File]
     image_format: str = "png"  # png, jpeg, jpg
     dpi: int = 150  # Resolution: 72, 150, 300, 600
     quality: int = 95  # JPEG quality (1-100)
+    png_compress_level: int = 1  # PNG zlib level (0-9), lower is faster
     split_pages: bool = True  # If True, each page as separate image
     alpha_channel: bool = False  # Include transparency for PNG
+    include_image_details: bool = True  # Per-image entries in the JSON summary
 
 
 class Pdf2imageTool(Tool):
@@ -67,7 +99,7 @@ class Pdf2imageTool(Tool):
 
             # Fetch the file
             try:
-                response = requests.get(url, timeout=30)
+                response = _get_http_session().get(url, timeout=30)
                 response.raise_for_status()
                 return response.content
             except requests.RequestException as e:
@@ -91,6 +123,23 @@ class Pdf2imageTool(Tool):
 
         raise ValueError(f"Unable to get file content for {file.filename}. File might not be properly loaded.")
 
+    def _prefetch_files(self, files: list[File]) -> Generator[tuple[File, Future], None, None]:
+        """
+        Yield each file with a future for its content, fetching the next few files
+        in the background so downloads overlap with rendering
+        """
+        downloads = {}
+        try:
+            for index, file in enumerate(files):
+                for ahead in range(index, min(index + _PREFETCH_FILES + 1, len(files))):
+                    if ahead not in downloads:
+                        downloads[ahead] = _DOWNLOAD_POOL.submit(self._get_file_content, files[ahead])
+                yield file, downloads.pop(index)
+        finally:
+            # Don't keep downloading for an invocation that has stopped early
+            for future in downloads.values():
+                future.cancel()
+
     def _invoke(
             self, tool_parameters: dict[str, Any]
     ) -> Generator[ToolInvokeMessage, None, None]:
@@ -109,9 +158,17 @@ class Pdf2imageTool(Tool):
         if params.quality < 1 or params.quality > 100:
             params.quality = 95
 
+        if params.png_compress_level < 0 or params.png_compress_level > 9:
+            params.png_compress_level = 1
+
         if params.image_format not in ["png", "jpeg", "jpg"]:
             params.image_format = "png"
 
+        if params.alpha_channel and params.image_format != "png":
+            yield self.create_text_message("Transparency is only supported for PNG output. "
+                                           "Please disable the alpha channel or choose PNG format.")
+            return
+
         try:
             # Import PyMuPDF
             try:
@@ -124,16 +181,120 @@ class Pdf2imageTool(Tool):
             # Import PIL for additional image processing
             from PIL import Image
 
+            # Prefer simplejpeg (libjpeg-turbo) for JPEG encoding, fall back to PyMuPDF
+            try:
+                import numpy as np
+                import simplejpeg
+            except ImportError:
+                simplejpeg = None
+
+            # Calculate zoom factor based on DPI, shared by every file
+            # Standard PDF is 72 DPI, so zoom = desired_dpi / 72
+            zoom = params.dpi / 72.0
+            mat = fitz_module.Matrix(zoom, zoom)
+
+            # Per-invocation invariants, resolved once instead of per page
+            is_jpeg = params.image_format in ("jpeg", "jpg")
+            mime_type = "image/jpeg" if is_jpeg else "image/png"
+            ext = "jpg" if is_jpeg else "png"
+
+            def render_page(page, mat):
+                """
+                Render a page to a pixmap ready for encoding
+                """
+                # Always 3-channel RGB; the 4th (alpha) channel only for PNG with transparency
+                return page.get_pixmap(matrix=mat, colorspace=fitz_module.csRGB, alpha=params.alpha_channel)
+
+            def encode_jpeg(samples, width: int, height: int, alpha: bool) -> bytes:
+                """
+                Encode raw RGB pixmap samples as JPEG
+                """
+                # JPEG pages are always rendered without alpha, so the pixmap buffer
+                # goes straight to libjpeg-turbo with no flattening and no PIL involved
+                if alpha:
+                    raise ValueError("JPEG output requires an RGB pixmap without alpha")
+                pixels = np.frombuffer(samples, dtype=np.uint8).reshape(height, width, 3)
+                return simplejpeg.encode_jpeg(pixels, quality=params.quality,
+                                              colorspace='RGB', fastdct=True)
+
+            def encode_png(samples, width: int, height: int, alpha: bool) -> bytes:
+                """
+                Encode raw RGB or premultiplied RGBA pixmap samples as PNG
+                """
+                # Pillow wraps the samples without copying and encodes them once; unlike
+                # pix.tobytes("png") it honours png_compress_level and runs off the render thread.
+                # PyMuPDF premultiplies colour by alpha, so the "RGBa" raw mode undoes that.
+                mode = "RGBA" if alpha else "RGB"
+                raw_mode = "RGBa" if alpha else "RGB"
+                img = Image.frombuffer(mode, (width, height), samples, "raw", raw_mode, 0, 1)
+                try:
+                    img_buffer = io.BytesIO()
+                    img.save(img_buffer, format="PNG", compress_level=params.png_compress_level)
+                    # getvalue() hands back the buffer's bytes without copying; a getbuffer()
+                    # view would not be the bytes create_blob_message expects
+                    return img_buffer.getvalue()
+                finally:
+                    img.close()
+
+            encode_page = encode_jpeg if is_jpeg else encode_png
+
+            # Without simplejpeg, JPEG pages are encoded natively by PyMuPDF instead of PIL.
+            # This has to run on the rendering thread since PyMuPDF is not thread-safe.
+            native_jpeg = is_jpeg and simplejpeg is None
+
+            def produce_pages(doc, page_count: int, mat, results: queue.Queue, stop: threading.Event):
+                """
+                Render and encode pages on a background thread, queueing finished pages in order.
+                PyMuPDF is not thread-safe, so this thread is the only one touching the document
+                and its pixmaps while it runs; encoding of earlier pages runs on the pool.
+                """
+                pending = deque()
+
+                def finish_oldest():
+                    page_num, pix, future = pending.popleft()
+                    # Wait for the encode so the pixmap is released on this thread
+                    if future.exception() is None:
+                        results.put((page_num, pix.width, pix.height, future))
+                    else:
+                        results.put((page_num, None, None, future))
+
+                try:
+                    for page_num in range(page_count):
+                        if stop.is_set():
+                            break
+                        pix = None
+                        try:
+                            pix = render_page(doc.load_page(page_num), mat)
+                            # Workers only see a view of the samples; the pixmap itself stays
+                            # owned by this thread until its page has been encoded
+                            if native_jpeg:
+                                future = Future()
+                                future.set_result(pix.tobytes("jpeg", jpg_quality=params.quality))
+                            else:
+                                future = _ENCODE_POOL.submit(encode_page, pix.samples_mv,
+                                                             pix.width, pix.height, bool(pix.alpha))
+                        except Exception as e:
+                            future = Future()
+                            future.set_exception(e)
+                        pending.append((page_num, pix, future))
+                        # Bound the number of rendered pages held in memory
+                        if len(pending) > _ENCODE_WORKERS:
+                            finish_oldest()
+                    while pending:
+                        finish_oldest()
+                finally:
+                    results.put(None)
+
             total_images_created = 0
             all_conversions = {}
 
-            for file in files:
+            for file, file_future in self._prefetch_files(files):
                 try:
                     logger.info(f"Processing PDF file: {file.filename}")
 
                     # Get file content (handles both blob and URL cases)
                     try:
-                        file_content = self._get_file_content(file)
+                        file_content = file_future.result()
                     except Exception as e:
                         error_msg = f"❌ Error accessing file {file.filename}: {str(e)}"
                         logger.error(error_msg)
@@ -142,104 +303,82 @@ class Pdf2imageTool(Tool):
                         continue
 
                     # Open PDF file
-                    file_bytes = io.BytesIO(file_content)
-                    doc = fitz_module.open(stream=file_bytes, filetype="pdf")
+                    doc = fitz_module.open(stream=file_content, filetype="pdf")
 
                     page_count = doc.page_count
                     file_base_name = Path(file.filename).stem
                     images_info = []
-
-                    # Calculate zoom factor based on DPI
-                    # Standard PDF is 72 DPI, so zoom = desired_dpi / 72
-                    zoom = params.dpi / 72.0
-                    mat = fitz_module.Matrix(zoom, zoom)
-
-                    for page_num in range(page_count):
-                        try:
-                            page = doc.load_page(page_num)
-
-                            # Render page to pixmap
-                            if params.alpha_channel and params.image_format == "png":
-                                pix = page.get_pixmap(matrix=mat, alpha=True)
-                            else:
-                                pix = page.get_pixmap(matrix=mat, alpha=False)
-
-                            # Convert to PIL Image
-                            img_data = pix.tobytes("png")
-                            img = Image.open(io.BytesIO(img_data))
-
-                            # Convert to RGB if saving as JPEG
-                            if params.image_format in ["jpeg", "jpg"]:
-                                if img.mode in ('RGBA', 'LA', 'P'):
-                                    # Create white background
-                                    background = Image.new('RGB', img.size, (255, 255, 255))
-                                    if img.mode == 'P':
-                                        img = img.convert('RGBA')
-                                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                                    img = background
-
-                            # Save image to bytes
-                            img_buffer = io.BytesIO()
-                            if params.image_format in ["jpeg", "jpg"]:
-                                img.save(img_buffer, format="JPEG", quality=params.quality, optimize=True)
-                                mime_type = "image/jpeg"
-                                ext = "jpg"
-                            else:
-                                img.save(img_buffer, format="PNG", optimize=True)
-                                mime_type = "image/png"
-                                ext = "png"
-
-                            img_bytes = img_buffer.getvalue()
-
-                            # Generate filename for this page
-                            if params.split_pages:
-                                image_filename = f"{file_base_name}_page_{page_num + 1:03d}.{ext}"
-                            else:
-                                image_filename = f"{file_base_name}.{ext}"
-
-                            # Store image info
-                            image_info = {
-                                "filename": image_filename,
-                                "page": page_num + 1,
-                                "width": img.width,
-                                "height": img.height,
-                                "format": params.image_format,
-                                "dpi": params.dpi,
-                                "size_bytes": len(img_bytes)
-                            }
-                            images_info.append(image_info)
-
-                            # Yield image as blob message
-                            yield self.create_blob_message(
-                                img_bytes,
-                                meta={
-                                    "mime_type": mime_type,
-                                    "filename": image_filename,
-                                    "page_number": page_num + 1,
-                                    "total_pages": page_count,
-                                    "source_pdf": file.filename
-                                }
-                            )
-
-                            # For debugging/preview, also send base64 encoded version in JSON
-                            # (limited to first few pages to avoid memory issues)
-                            if page_num < 3:  # Only first 3 pages for preview
-                                image_info["preview_base64"] = base64.b64encode(img_bytes).decode('utf-8')[
-                                                               :1000] + "..."
-
-                            total_images_created += 1
-
-                            # Clean up
-                            pix = None
-                            img.close()
-
-                        except Exception as e:
-                            error_msg = f"Error converting page {page_num + 1} of {file.filename}: {str(e)}"
-                            logger.error(error_msg)
-                            images_info.append({
-                                "page": page_num + 1,
-                                "error": str(e)
-                            })
+                    succeeded = 0
+                    failed = 0
+
+                    # Render on a producer thread so the next pages are rendered and encoded
+                    # while earlier ones are being handed to Dify
+                    results = queue.Queue(maxsize=2)
+                    stop = threading.Event()
+                    producer = threading.Thread(target=produce_pages, args=(doc, page_count, mat, results, stop),
+                                                name="pdf2image-render", daemon=True)
+                    producer.start()
+                    finished = False
+                    try:
+                        while True:
+                            item = results.get()
+                            if item is None:
+                                finished = True
+                                break
+                            page_num, width, height, future = item
+                            try:
+                                img_bytes = future.result()
+
+                                # Generate filename for this page
+                                if params.split_pages:
+                                    image_filename = f"{file_base_name}_page_{page_num + 1:03d}.{ext}"
+                                else:
+                                    image_filename = f"{file_base_name}.{ext}"
+
+                                # Store image info
+                                if params.include_image_details:
+                                    image_info = {
+                                        "filename": image_filename,
+                                        "page": page_num + 1,
+                                        "width": width,
+                                        "height": height,
+                                        "format": params.image_format,
+                                        "dpi": params.dpi,
+                                        "size_bytes": len(img_bytes)
+                                    }
+                                    images_info.append(image_info)
+
+                                # Yield image as blob message
+                                yield self.create_blob_message(
+                                    img_bytes,
+                                    meta={
+                                        "mime_type": mime_type,
+                                        "filename": image_filename,
+                                        "page_number": page_num + 1,
+                                        "total_pages": page_count,
+                                        "source_pdf": file.filename
+                                    }
+                                )
+
+                                succeeded += 1
+                                total_images_created += 1
+
+                            except Exception as e:
+                                error_msg = f"Error converting page {page_num + 1} of {file.filename}: {str(e)}"
+                                logger.error(error_msg)
+                                failed += 1
+                                if params.include_image_details:
+                                    images_info.append({
+                                        "page": page_num + 1,
+                                        "error": str(e)
+                                    })
+                    finally:
+                        # Drain up to the end marker so the producer can never block on a full queue
+                        stop.set()
+                        if not finished:
+                            while results.get() is not None:
+                                pass
+                        producer.join()
 
                     # Close the document
                     doc.close()
@@ -247,14 +386,16 @@ class Pdf2imageTool(Tool):
                     # Store conversion info
                     all_conversions[file.filename] = {
                         "total_pages": page_count,
-                        "images_created": len([i for i in images_info if "error" not in i]),
+                        "images_created": succeeded,
+                        "images_failed": failed,
                         "format": params.image_format,
-                        "dpi": params.dpi,
-                        "images": images_info
+                        "dpi": params.dpi
                     }
+                    if params.include_image_details:
+                        all_conversions[file.filename]["images"] = images_info
 
                     # Send success message for this file
-                    success_msg = f"✅ Successfully converted {file.filename}: {page_count} pages → {len([i for i in images_info if 'error' not in i])} images"
+                    success_msg = f"✅ Successfully converted {file.filename}: {page_count} pages → {succeeded} images"
                     yield self.create_text_message(success_msg)
 
                 except Exception as e:
@@ -270,7 +411,8 @@ class Pdf2imageTool(Tool):
                 "settings": {
                     "format": params.image_format,
                     "dpi": params.dpi,
-                    "quality": params.quality if params.image_format in ["jpeg", "jpg"] else "N/A",
+                    "quality": params.quality if is_jpeg else "N/A",
+                    "png_compress_level": params.png_compress_level if not is_jpeg else "N/A",
                     "split_pages": params.split_pages,
                     "alpha_channel": params.alpha_channel
                 },